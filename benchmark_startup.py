@@ -0,0 +1,76 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+# Repository root, imported by the probe from a scratch working directory
+REPO_DIR = Path(__file__).resolve().parent
+
+# Heavy OCR/LLM dependencies the web tier should not load
+HEAVY_MODULES = ("fitz", "PIL", "pytesseract", "requests", "utils")
+
+# Runs in a fresh interpreter so every measurement is a cold worker start
+PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import main
+imported = time.perf_counter()
+from fastapi.testclient import TestClient
+with TestClient(main.app) as client:
+    client.get("/health")
+ready = time.perf_counter()
+if {load_worker}:
+    import utils
+rss_kb = int(open("/proc/self/status").read().split("VmRSS:")[1].split()[0])
+print(json.dumps({{
+    "import_ms": (imported - started) * 1000,
+    "ready_ms": (ready - started) * 1000,
+    "rss_mb": rss_kb / 1024,
+    "heavy_modules": [name for name in {heavy} if name in sys.modules],
+}}))
+"""
+
+def measure(runs: int, load_worker: bool) -> dict:
+    """Start the app `runs` times in fresh processes and return median timings and RSS
+
+    The app runs in a temporary working directory so its database, uploads
+    and app.log do not touch the ones in the repository.
+    """
+    samples = []
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [str(REPO_DIR), os.environ.get("PYTHONPATH")])))
+    for _ in range(runs):
+        probe = PROBE.format(load_worker=load_worker, heavy=HEAVY_MODULES)
+        with tempfile.TemporaryDirectory() as workdir:
+            # Static files and templates are only read, link them instead of copying
+            for name in ("static", "templates"):
+                os.symlink(REPO_DIR / name, Path(workdir) / name)
+            output = subprocess.run(
+                [sys.executable, "-c", probe], cwd=workdir, env=env, capture_output=True, text=True, check=True
+            ).stdout
+        samples.append(json.loads(output.strip().splitlines()[-1]))
+
+    return {
+        "import_ms": statistics.median(sample["import_ms"] for sample in samples),
+        "ready_ms": statistics.median(sample["ready_ms"] for sample in samples),
+        "rss_mb": statistics.median(sample["rss_mb"] for sample in samples),
+        "heavy_modules": samples[-1]["heavy_modules"],
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure startup time and RSS of a web worker")
+    parser.add_argument("--runs", type=int, default=5, help="Number of cold starts to measure")
+
+    args = parser.parse_args()
+
+    for label, load_worker in (("web worker", False), ("web worker + OCR/LLM", True)):
+        result = measure(args.runs, load_worker)
+        print(
+            f"{label:<22} import {result['import_ms']:7.1f} ms  "
+            f"ready {result['ready_ms']:7.1f} ms  "
+            f"RSS {result['rss_mb']:6.1f} MB  "
+            f"heavy modules: {', '.join(result['heavy_modules']) or 'none'}"
+        )
@@ -2,6 +2,8 @@
 
 # Import potřebných knihoven
 from sqlmodel import SQLModel, Session, create_engine  # SQLModel pro práci s databází
+from sqlalchemy import inspect, text  # Pro zjištění struktury existujících tabulek
+from sqlalchemy.exc import OperationalError  # Chyba při změně struktury tabulky
 from pathlib import Path  # Pro práci s cestami k souborům
 
 # Vytvoření adresáře pro databázi, pokud neexistuje
@@ -22,6 +24,31 @@ def create_db_and_tables():
     Tato funkce se volá při startu aplikace a zajistí, že všechny potřebné tabulky existují.
     """
     SQLModel.metadata.create_all(engine)  # Vytvoří všechny tabulky definované v modelech
+    add_missing_columns()  # Doplní sloupce přidané do modelů po vytvoření databáze
+
+def add_missing_columns():
+    """Doplní do existujících tabulek sloupce, které v databázi chybí
+    
+    create_all() vytváří pouze chybějící tabulky, ale nemění ty existující.
+    Nové sloupce v modelech jsou vždy volitelné (nullable), takže je lze
+    do SQLite databáze bezpečně přidat pomocí ALTER TABLE ADD COLUMN.
+    Při souběžném startu více procesů může sloupec mezitím přidat jiný
+    proces - chyba "duplicate column name" se proto ignoruje.
+    """
+    inspector = inspect(engine)  # Inspektor pro čtení struktury databáze
+    for table in SQLModel.metadata.sorted_tables:
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue  # Sloupec už v databázi je
+            column_type = column.type.compile(dialect=engine.dialect)  # Typ sloupce v SQL
+            try:
+                with engine.begin() as connection:  # Každý sloupec ve vlastní transakci
+                    connection.execute(text(f'ALTER TABLE {table.name} ADD COLUMN "{column.name}" {column_type}'))
+            except OperationalError as e:
+                if "duplicate column name" not in str(e):
+                    raise
+                # Sloupec mezitím přidal jiný proces
 
 def get_session():
     """Získá databázovou session pro práci s databází
@@ -0,0 +1,409 @@
+import argparse
+import hashlib
+import json
+import logging
+import shutil
+import signal
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+
+from sqlmodel import Session, select
+
+from database import create_db_and_tables, engine
+from models.upload import Upload
+from models.result import InvoiceResult
+from storage import STORAGE_MAINTENANCE_HOURS, UPLOAD_DIR, run_maintenance, store_file
+from utils import get_mime_type, process_invoice
+
+# inotify is optional (Linux only); without it the inbox is polled
+try:
+    from inotify_simple import INotify, flags as inotify_flags
+except (ImportError, OSError):
+    INotify = None
+
+logger = logging.getLogger("ingest")
+
+# Subdirectories of the inbox for files being processed and finished files
+PROCESSING_DIR = "processing"
+DONE_DIR = "done"
+FAILED_DIR = "failed"
+
+class InboxIngester:
+    """Watches an inbox directory and processes invoices dropped into it
+
+    A file is ingested once its size and modification time stop changing for
+    `settle_seconds`. Ready files are stored as `Upload` rows in batches and
+    processed in a thread pool; the original file waits in inbox/processing
+    and is then moved to inbox/done or inbox/failed. New files are not picked
+    up while more than `max_backlog` invoices are waiting for processing.
+    Files left in inbox/processing by a previous run are recovered on start.
+    Every `maintenance_hours` storage garbage collection (and retention, when
+    STORAGE_RETENTION_DAYS is set) runs in a background thread.
+    """
+
+    def __init__(
+        self,
+        inbox: Path,
+        model: str = "llama3",
+        fast_model: Optional[str] = None,
+        workers: int = 4,
+        batch_size: int = 50,
+        max_backlog: int = 200,
+        poll_interval: float = 2.0,
+        settle_seconds: float = 2.0,
+        maintenance_hours: float = STORAGE_MAINTENANCE_HOURS,
+    ):
+        self.inbox = inbox
+        self.model = model
+        self.fast_model = fast_model
+        self.batch_size = batch_size
+        self.max_backlog = max_backlog
+        self.poll_interval = poll_interval
+        self.settle_seconds = settle_seconds
+        self.maintenance_hours = maintenance_hours
+
+        for folder in (PROCESSING_DIR, DONE_DIR, FAILED_DIR):
+            (inbox / folder).mkdir(parents=True, exist_ok=True)
+        UPLOAD_DIR.mkdir(exist_ok=True)
+
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ingest")
+        self._backlog = 0
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._maintenance: Optional[threading.Thread] = None
+        self._last_maintenance = 0.0
+        # Last seen (size, mtime) of files still being written
+        self._seen: Dict[Path, Tuple[int, float]] = {}
+        # Queued files that could not be moved out of the inbox, skipped by the scan
+        self._queued_in_inbox: Set[Path] = set()
+        self._inotify = self._create_inotify()
+
+    def _create_inotify(self):
+        """Watch the inbox with inotify if available"""
+        if INotify is None:
+            logger.info(f"inotify_simple not installed, polling {self.inbox} every {self.poll_interval}s")
+            return None
+
+        inotify = INotify()
+        inotify.add_watch(
+            str(self.inbox),
+            inotify_flags.CLOSE_WRITE | inotify_flags.MOVED_TO | inotify_flags.CREATE,
+        )
+        logger.info(f"Watching {self.inbox} with inotify")
+        return inotify
+
+    @property
+    def backlog(self) -> int:
+        """Number of ingested invoices waiting for or in processing"""
+        with self._lock:
+            return self._backlog
+
+    def stop(self) -> None:
+        """Stop taking new files (called from the SIGTERM handler)"""
+        logger.info("Stopping intake, waiting for invoices in progress")
+        self._stopping.set()
+
+    def maybe_run_maintenance(self) -> None:
+        """Start storage maintenance in the background when it is due and not already running"""
+        if self.maintenance_hours <= 0 or time.time() - self._last_maintenance < self.maintenance_hours * 3600:
+            return
+        if self._maintenance is not None and self._maintenance.is_alive():
+            return
+
+        self._last_maintenance = time.time()
+        self._maintenance = threading.Thread(target=run_maintenance, name="storage-maintenance", daemon=True)
+        self._maintenance.start()
+
+    def wait_for_changes(self) -> None:
+        """Block until the inbox changes or the poll interval elapses"""
+        if self._inotify is not None:
+            self._inotify.read(timeout=int(self.poll_interval * 1000))
+        else:
+            self._stopping.wait(self.poll_interval)
+
+    def find_ready_files(self) -> Tuple[List[Path], int]:
+        """Return files that finished being written and the number of files still settling"""
+        ready = []
+        current = {}
+        now = time.time()
+        with self._lock:
+            queued = set(self._queued_in_inbox)
+
+        for path in sorted(self.inbox.iterdir()):
+            if not path.is_file() or path.name.startswith(".") or path in queued:
+                continue
+
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue  # Removed or renamed in the meantime
+
+            signature = (stat.st_size, stat.st_mtime)
+            if self._seen.get(path) == signature and now - stat.st_mtime >= self.settle_seconds:
+                ready.append(path)
+            else:
+                current[path] = signature
+
+        self._seen = current
+        return ready, len(current)
+
+    def ingest(self, paths: List[Path]) -> None:
+        """Store a batch of inbox files as uploads and queue them for processing
+
+        A file that cannot be stored is moved to inbox/failed. Files are moved
+        to inbox/processing only after the batch is committed; if the commit
+        fails, they stay in the inbox and are retried on a later scan. A file
+        that cannot be moved is processed from the inbox and skipped by scans
+        until it finishes.
+        """
+        stored = []
+
+        with Session(engine) as session:
+            for path in paths:
+                try:
+                    mime_type = get_mime_type(str(path))
+                    if not mime_type.startswith("application/pdf") and not mime_type.startswith("image/"):
+                        logger.warning(f"Unsupported file type {mime_type}: {path.name}")
+                        self._move_safely(path, FAILED_DIR)
+                        continue
+
+                    with open(path, "rb") as source:
+                        file_path, file_size, content_hash = store_file(source, path.suffix)
+                except Exception as e:
+                    logger.error(f"Error storing {path.name}: {e}")
+                    self._move_safely(path, FAILED_DIR)
+                    continue
+
+                upload = Upload(
+                    filename=Path(file_path).name,
+                    original_filename=path.name,
+                    file_path=file_path,
+                    file_size=file_size,
+                    content_hash=content_hash,
+                    mime_type=mime_type,
+                    upload_date=datetime.now(),
+                    processed=False,
+                )
+                session.add(upload)
+                stored.append((path, upload))
+
+            # One commit for the whole batch
+            try:
+                session.commit()
+            except Exception as e:
+                session.rollback()
+                logger.error(f"Error saving {len(stored)} uploads, retrying on the next scan: {e}")
+                return
+
+            jobs = [(path, upload.id, upload.file_path) for path, upload in stored]
+
+        for path, upload_id, file_path in jobs:
+            original = self._move_safely(path, PROCESSING_DIR)
+            if original is None:
+                # The upload is already saved; process it from the inbox without ingesting it again
+                original = path
+                with self._lock:
+                    self._queued_in_inbox.add(path)
+            self._submit(upload_id, file_path, original)
+
+        logger.info(f"Ingested {len(jobs)} files, backlog {self.backlog}")
+
+    def recover_processing(self) -> None:
+        """Resume files left in inbox/processing by a previous run
+
+        A file whose upload is still unprocessed is queued again, a file whose
+        upload finished is moved to done/failed, and a file without an upload
+        is returned to the inbox to be ingested again.
+        """
+        for path in sorted((self.inbox / PROCESSING_DIR).iterdir()):
+            if not path.is_file():
+                continue
+
+            try:
+                content_hash = file_hash(path)
+                with Session(engine) as session:
+                    uploads = session.exec(
+                        select(Upload)
+                        .where(Upload.content_hash == content_hash, Upload.original_filename == path.name)
+                        .order_by(Upload.id.desc())
+                    ).all()
+                    pending = next((upload for upload in uploads if not upload.processed), None)
+                    if pending is not None:
+                        job = (pending.id, pending.file_path)
+                    elif uploads:
+                        job = None
+                        succeeded = processing_succeeded(session, uploads[0])
+                    else:
+                        job = None
+                        succeeded = None
+
+                if job is not None:
+                    logger.info(f"Resuming {path.name} (upload {job[0]})")
+                    self._submit(job[0], job[1], path)
+                elif succeeded is None:
+                    logger.info(f"Returning {path.name} to the inbox")
+                    move_to(path, self.inbox)
+                else:
+                    move_to(path, self.inbox / (DONE_DIR if succeeded else FAILED_DIR))
+            except Exception as e:
+                logger.error(f"Error recovering {path.name}: {e}")
+
+    def _submit(self, upload_id: int, file_path: str, original: Path) -> None:
+        """Queue an upload for processing"""
+        with self._lock:
+            self._backlog += 1
+        future = self._executor.submit(
+            process_invoice, upload_id=upload_id, file_path=file_path, model=self.model, fast_model=self.fast_model
+        )
+        future.add_done_callback(lambda done: self._finish(done, upload_id, original))
+
+    def _move_safely(self, path: Path, folder: str) -> Optional[Path]:
+        """Move a file into an inbox subfolder, logging instead of raising on errors"""
+        try:
+            return move_to(path, self.inbox / folder)
+        except Exception as e:
+            logger.error(f"Error moving {path.name} to {folder}: {e}")
+            return None
+
+    def _finish(self, future: Future, upload_id: int, original: Path) -> None:
+        """Move the original file to done/failed according to the processing result
+
+        An invoice cancelled on shutdown is left where it is; files in
+        inbox/processing are queued again on the next start.
+        """
+        try:
+            if future.cancelled():
+                logger.info(f"Processing of upload {upload_id} cancelled, it will be resumed on the next start")
+                return
+
+            with Session(engine) as session:
+                upload = session.get(Upload, upload_id)
+                succeeded = future.exception() is None and upload is not None and processing_succeeded(session, upload)
+
+            move_to(original, self.inbox / (DONE_DIR if succeeded else FAILED_DIR))
+            if not succeeded:
+                logger.error(f"Processing of upload {upload_id} failed (no result or every LLM call failed)")
+        except Exception as e:
+            logger.error(f"Error finishing upload {upload_id}: {e}")
+        finally:
+            with self._lock:
+                self._backlog -= 1
+                self._queued_in_inbox.discard(original)
+
+    def run(self, once: bool = False) -> None:
+        """Ingest files until stopped; with `once`, stop when the inbox is empty and processed"""
+        backpressure_logged = False
+        self.recover_processing()
+
+        while not self._stopping.is_set():
+            self.maybe_run_maintenance()
+            ready, settling = self.find_ready_files()
+
+            capacity = self.max_backlog - self.backlog
+            if ready and capacity <= 0:
+                if not backpressure_logged:
+                    logger.info(f"Backlog of {self.backlog} invoices, pausing ingestion")
+                    backpressure_logged = True
+            else:
+                backpressure_logged = False
+                ready = ready[:capacity]
+                for start in range(0, len(ready), self.batch_size):
+                    self.ingest(ready[start:start + self.batch_size])
+
+            if once and not ready and not settling and self.backlog == 0:
+                break
+
+            self.wait_for_changes()
+
+    def close(self) -> None:
+        """Wait for invoices in progress to finish and cancel the ones still queued"""
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        if self._inotify is not None:
+            self._inotify.close()
+
+def processing_succeeded(session: Session, upload: Upload) -> bool:
+    """Check that an upload was processed and at least one LLM call of its latest result succeeded
+
+    When Ollama is unreachable the result is stored with empty fields;
+    such invoices count as failed.
+    """
+    if not upload.processed:
+        return False
+
+    result = session.exec(
+        select(InvoiceResult).where(InvoiceResult.upload_id == upload.id).order_by(InvoiceResult.id.desc())
+    ).first()
+    if result is None:
+        return False
+    if not result.llm_calls:
+        return True  # Result from before calls were recorded
+
+    return any(call.get("ok") for call in json.loads(result.llm_calls))
+
+def file_hash(path: Path) -> str:
+    """Compute the SHA-256 of a file (same as the storage content hash)"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as source:
+        for chunk in iter(lambda: source.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def move_to(path: Path, folder: Path) -> Path:
+    """Move a file into a folder, prefixing the name with a timestamp if it already exists there"""
+    destination = folder / path.name
+    if destination.exists():
+        destination = folder / f"{datetime.now():%Y%m%d%H%M%S%f}_{path.name}"
+    return Path(shutil.move(str(path), str(destination)))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Watch an inbox directory and process invoices dropped into it")
+    parser.add_argument("--inbox", type=Path, default=Path("inbox"), help="Directory to watch for new files")
+    parser.add_argument("--model", type=str, default="llama3", help="Ollama model used for escalation")
+    parser.add_argument("--fast-model", type=str, default=None, help="Fast Ollama model tried first (empty disables the cascade)")
+    parser.add_argument("--workers", type=int, default=4, help="Number of invoices processed in parallel")
+    parser.add_argument("--batch-size", type=int, default=50, help="Maximum number of files stored in one database commit")
+    parser.add_argument("--max-backlog", type=int, default=200, help="Pause ingestion while this many invoices are waiting")
+    parser.add_argument("--poll-interval", type=float, default=2.0, help="Seconds between inbox scans")
+    parser.add_argument("--settle-seconds", type=float, default=2.0, help="Seconds a file must stay unchanged before ingestion")
+    parser.add_argument("--maintenance-hours", type=float, default=STORAGE_MAINTENANCE_HOURS, help="Hours between storage GC/retention runs (0 disables)")
+    parser.add_argument("--once", action="store_true", help="Process the current inbox contents and exit")
+
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler("app.log"),
+            logging.StreamHandler()
+        ]
+    )
+
+    args.inbox.mkdir(parents=True, exist_ok=True)
+    create_db_and_tables()
+
+    ingester = InboxIngester(
+        args.inbox,
+        model=args.model,
+        fast_model=args.fast_model,
+        workers=args.workers,
+        batch_size=args.batch_size,
+        max_backlog=args.max_backlog,
+        poll_interval=args.poll_interval,
+        settle_seconds=args.settle_seconds,
+        maintenance_hours=args.maintenance_hours,
+    )
+
+    # docker stop sends SIGTERM: stop intake and let queued invoices finish
+    signal.signal(signal.SIGTERM, lambda signum, frame: ingester.stop())
+
+    try:
+        ingester.run(once=args.once)
+    except KeyboardInterrupt:
+        ingester.stop()
+    finally:
+        ingester.close()
@@ -2,16 +2,16 @@
 
 # Import potřebných knihoven
 from fastapi import FastAPI  # Framework pro vytvoření API
-from fastapi.staticfiles import StaticFiles  # Pro obsluhu statických souborů (CSS, JS)
 from fastapi.middleware.cors import CORSMiddleware  # Pro povolení CORS
 import logging  # Pro logování událostí
-from pathlib import Path  # Pro práci s cestami k souborům
 
 # Import routerů (směrovačů) pro různé části aplikace
 from routers import upload, result  # upload.py - nahrávání souborů, result.py - zpracování a výsledky
 
 # Import funkcí pro práci s databází
 from database import create_db_and_tables  # Funkce pro vytvoření databáze a tabulek
+from static_files import CachedStaticFiles  # Statické soubory s dlouhodobým cachováním
+from storage import UPLOAD_DIR  # Adresář úložiště nahraných souborů
 
 # Konfigurace logování - nastavení formátu a místa ukládání logů
 logging.basicConfig(
@@ -41,14 +41,14 @@ app.add_middleware(
 )
 
 # Připojení statických souborů (CSS, JS, obrázky) - budou dostupné na URL /static
-app.mount("/static", StaticFiles(directory="static"), name="static")
+# Soubory odkazované přes static_url() mají otisk v URL a cachují se natrvalo
+app.mount("/static", CachedStaticFiles(directory="static"), name="static")
 
 # Připojení routerů (směrovačů) pro různé části aplikace
 app.include_router(upload.router)  # Router pro nahrávání souborů
 app.include_router(result.router)  # Router pro zpracování a výsledky
 
 # Vytvoření adresáře pro nahrané soubory, pokud neexistuje
-UPLOAD_DIR = Path("uploads")  # Cesta k adresáři
 UPLOAD_DIR.mkdir(exist_ok=True)  # Vytvoření adresáře (pokud již existuje, nic se nestane)
 
 # Vytvoření databáze a tabulek při startu aplikace
@@ -62,9 +62,24 @@ class InvoiceResult(SQLModel, table=True):
     # Použitý AI model pro zpracování (např. llama3, mistral)
     llm_model_used: Optional[str] = None
     
-    # Skóre spolehlivosti extrakce (0.0 až 1.0)
+    # Skóre spolehlivosti extrakce (0.0 až 1.0), počítané z validace polí
     confidence_score: Optional[float] = None
-    
+
+    # Rozhodnutí směrování mezi modely (fast, escalated_fields, escalated_document, single)
+    routing_decision: Optional[str] = None
+
+    # Pole, která byla kvůli neúspěšné validaci předána většímu modelu (oddělená čárkou)
+    escalated_fields: Optional[str] = None
+
+    # Záznam jednotlivých volání modelů ve formátu JSON (model, latence, počet tokenů)
+    llm_calls: Optional[str] = None
+
+    # Celková doba volání AI modelů v milisekundách
+    llm_latency_ms: Optional[float] = None
+
+    # Celkový počet tokenů zpracovaných AI modely (vstup + výstup)
+    llm_tokens: Optional[int] = None
+
     def __repr__(self):
         """Textová reprezentace objektu pro ladění"""
         return f"<InvoiceResult {self.id}: {self.invoice_number}>"
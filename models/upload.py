@@ -34,7 +34,13 @@ class Upload(SQLModel, table=True):
     
     # Indikace, zda byl soubor již zpracován
     processed: bool = Field(default=False)
-    
+
+    # SHA-256 otisk obsahu souboru (určuje umístění v úložišti a slouží k deduplikaci)
+    content_hash: Optional[str] = None
+
+    # Datum a čas smazání originálu podle pravidel uchovávání (text a výsledky zůstávají)
+    file_purged_date: Optional[datetime] = None
+
     def __repr__(self):
         """Textová reprezentace objektu pro ladění"""
         return f"<Upload {self.id}: {self.original_filename}>"
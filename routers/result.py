@@ -2,21 +2,108 @@
 
 # Import potřebných knihoven
 from fastapi import APIRouter, Depends, HTTPException, Request, BackgroundTasks  # Základní FastAPI komponenty
-from fastapi.responses import HTMLResponse  # Pro vrácení HTML odpovědí
+from fastapi.responses import HTMLResponse, JSONResponse, Response  # Pro vrácení HTML, JSON a prázdných odpovědí
 from fastapi.templating import Jinja2Templates  # Pro práci s šablonami
 from sqlmodel import Session, select  # Pro práci s databází
-from typing import Optional  # Pro volitelné parametry
+from typing import Optional, Dict  # Pro volitelné parametry
+from collections import OrderedDict  # Pro LRU cache vykreslených stránek
+from datetime import timezone  # Pro převod data do UTC
+from email.utils import format_datetime, parsedate_to_datetime  # Pro HTTP formát data
 import os  # Pro práci se soubory
+import json  # Pro načtení záznamu volání modelů
 
 # Import modelů a funkcí
 from models.upload import Upload  # Model pro nahrané soubory
 from models.result import InvoiceResult  # Model pro výsledky zpracování
 from database import get_session  # Funkce pro získání databázové session
-from utils import process_invoice  # Funkce pro zpracování faktur
+from static_files import static_url  # URL statických souborů s otiskem
+# utils (OCR a AI - fitz, PIL, pytesseract, requests) se importuje až při prvním zpracování,
+# aby webové procesy, které nic nezpracovávají, tyto knihovny nenačítaly
 
 # Vytvoření routeru a šablon
 router = APIRouter()  # Router pro registraci endpointů
 templates = Jinja2Templates(directory="templates")  # Šablony z adresáře templates
+templates.env.globals["static_url"] = static_url  # Funkce pro odkazy na statické soubory v šablonách
+
+# LRU cache vykreslených stránek výsledků: upload_id -> (ETag výsledku, HTML)
+RESULT_CACHE_SIZE = int(os.environ.get("RESULT_CACHE_SIZE", "256"))  # Maximální počet stránek v cache
+rendered_results: "OrderedDict[int, tuple]" = OrderedDict()
+
+def run_processing(upload_id: int, file_path: str, model: str, fast_model: Optional[str]):
+    """Spustí zpracování faktury (úloha na pozadí)
+    
+    Synchronní funkce běží ve vlákně mimo event loop, takže ani první
+    import OCR a AI knihoven (utils) neblokuje obsluhu ostatních požadavků.
+    """
+    from utils import process_invoice  # Odložený import OCR a AI části aplikace
+    process_invoice(upload_id=upload_id, file_path=file_path, model=model, fast_model=fast_model)
+
+def get_latest_result(session: Session, upload_id: int) -> Optional[InvoiceResult]:
+    """Vrátí nejnovější výsledek zpracování nahraného souboru
+    
+    Při opakovaném zpracování vzniká nový záznam, proto se bere ten poslední.
+    """
+    return session.exec(
+        select(InvoiceResult)
+        .where(InvoiceResult.upload_id == upload_id)  # Vyhledání podle upload_id
+        .order_by(InvoiceResult.id.desc())  # Nejnovější výsledek jako první
+    ).first()
+
+def result_cache_headers(result: InvoiceResult) -> Dict[str, str]:
+    """Vytvoří hlavičky ETag a Last-Modified podle data zpracování výsledku
+    
+    Hotový výsledek se už nemění (opakované zpracování vytvoří nový záznam),
+    prohlížeč si ho proto může uložit a při dalším otevření jen ověřit.
+    """
+    processed_at = result.processed_date.astimezone(timezone.utc)  # Datum zpracování v UTC
+    return {
+        "ETag": f'"{result.id}-{int(processed_at.timestamp() * 1000)}"',  # Verze výsledku
+        "Last-Modified": format_datetime(processed_at, usegmt=True),  # Datum ve formátu HTTP
+        "Cache-Control": "no-cache",  # Cachovat, ale před použitím vždy ověřit
+    }
+
+def is_not_modified(request: Request, headers: Dict[str, str]) -> bool:
+    """Zjistí, zda má klient v cache aktuální verzi (If-None-Match / If-Modified-Since)"""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        # If-None-Match má přednost před If-Modified-Since
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in tags or headers["ETag"] in tags
+    
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+            return parsedate_to_datetime(headers["Last-Modified"]) <= since
+        except (TypeError, ValueError):
+            return False  # Neplatné datum - odpověď se pošle celá
+    
+    return False
+
+def render_result_page(request: Request, upload: Upload, result: InvoiceResult, etag: str) -> str:
+    """Vykreslí stránku výsledku, případně ji vrátí z LRU cache
+    
+    Stránka v cache je platná, dokud se nezmění ETag výsledku.
+    """
+    cached = rendered_results.get(upload.id)
+    if cached and cached[0] == etag:
+        rendered_results.move_to_end(upload.id)  # Označení jako naposledy použité
+        return cached[1]
+    
+    html = templates.get_template("result.html").render(
+        {
+            "request": request,  # Požadavek (vyžadováno Jinja2)
+            "upload": upload,  # Informace o nahraném souboru
+            "result": result,  # Výsledek zpracování
+            "processing": False  # Indikace, že zpracování je dokončeno
+        }
+    )
+    
+    rendered_results[upload.id] = (etag, html)
+    rendered_results.move_to_end(upload.id)
+    while len(rendered_results) > RESULT_CACHE_SIZE:
+        rendered_results.popitem(last=False)  # Odstranění nejdéle nepoužité stránky
+    return html
 
 @router.get("/result/{upload_id}", response_class=HTMLResponse)
 async def get_result(
@@ -36,22 +123,15 @@ async def get_result(
         raise HTTPException(status_code=404, detail="Soubor nebyl nalezen")
     
     # Kontrola, zda existuje výsledek zpracování
-    result = session.exec(
-        select(InvoiceResult).where(InvoiceResult.upload_id == upload_id)  # Vyhledání podle upload_id
-    ).first()  # Získání prvního (a jediného) výsledku
+    result = get_latest_result(session, upload_id)
     
     # Vrácení odpovídající šablony podle stavu zpracování
     if result:
-        # Pokud výsledek existuje, zobrazíme ho
-        return templates.TemplateResponse(
-            "result.html",  # Použitá šablona
-            {
-                "request": request,  # Požadavek (vyžadováno Jinja2)
-                "upload": upload,  # Informace o nahraném souboru
-                "result": result,  # Výsledek zpracování
-                "processing": False  # Indikace, že zpracování je dokončeno
-            }
-        )
+        # Pokud výsledek existuje, zobrazíme ho (nebo potvrdíme platnost verze v cache klienta)
+        headers = result_cache_headers(result)
+        if is_not_modified(request, headers):
+            return Response(status_code=304, headers=headers)
+        return HTMLResponse(render_result_page(request, upload, result, headers["ETag"]), headers=headers)
     else:
         # Pokud výsledek ještě neexistuje, zobrazíme stránku s informací o zpracování
         return templates.TemplateResponse(
@@ -60,7 +140,8 @@ async def get_result(
                 "request": request,  # Požadavek (vyžadováno Jinja2)
                 "upload": upload,  # Informace o nahraném souboru
                 "processing": True  # Indikace, že zpracování stále probíhá
-            }
+            },
+            headers={"Cache-Control": "no-store"}  # Stav zpracování se nesmí cachovat
         )
 
 @router.post("/process/{upload_id}")
@@ -68,6 +149,7 @@ async def process_upload(
     upload_id: int,  # ID nahraného souboru z URL
     background_tasks: BackgroundTasks,  # Pro spuštění úloh na pozadí
     model: Optional[str] = "llama3",  # Volitelný parametr pro výběr AI modelu
+    fast_model: Optional[str] = None,  # Rychlý model zkoušený jako první (prázdný řetězec vypne kaskádu)
     session: Session = Depends(get_session)  # Databázová session (automaticky získána)
 ):
     """Zpracuje nahraný soubor na pozadí pomocí OCR a AI
@@ -86,12 +168,16 @@ async def process_upload(
         # Pokud soubor neexistuje na disku, vrátíme chybu 404
         raise HTTPException(status_code=404, detail="Soubor nebyl nalezen na disku")
     
+    # Zneplatnění vykreslené stránky v cache - výsledek se zpracuje znovu
+    rendered_results.pop(upload_id, None)
+    
     # Přidání úlohy zpracování na pozadí
     background_tasks.add_task(
-        process_invoice,  # Funkce, která bude spuštěna na pozadí
+        run_processing,  # Funkce, která bude spuštěna na pozadí
         upload_id=upload_id,  # ID nahraného souboru
         file_path=upload.file_path,  # Cesta k souboru
-        model=model  # Použitý AI model
+        model=model,  # Větší AI model pro eskalaci
+        fast_model=fast_model  # Rychlý AI model (None = výchozí z konfigurace)
     )
     
     # Vrácení informace o zahájení zpracování
@@ -99,6 +185,7 @@ async def process_upload(
 
 @router.get("/api/result/{upload_id}")
 async def get_result_api(
+    request: Request,  # Požadavek od klienta
     upload_id: int,  # ID nahraného souboru z URL
     session: Session = Depends(get_session)  # Databázová session (automaticky získána)
 ):
@@ -114,11 +201,14 @@ async def get_result_api(
         raise HTTPException(status_code=404, detail="Soubor nebyl nalezen")
     
     # Kontrola, zda existuje výsledek zpracování
-    result = session.exec(
-        select(InvoiceResult).where(InvoiceResult.upload_id == upload_id)  # Vyhledání podle upload_id
-    ).first()  # Získání prvního (a jediného) výsledku
+    result = get_latest_result(session, upload_id)
     
     if result:
+        # Pokud má klient aktuální verzi výsledku, stačí odpověď 304
+        headers = result_cache_headers(result)
+        if is_not_modified(request, headers):
+            return Response(status_code=304, headers=headers)
+        
         # Pokud výsledek existuje, převedeme ho na slovník a vrátíme
         result_dict = {
             "id": result.id,  # ID výsledku
@@ -137,9 +227,17 @@ async def get_result_api(
             "customer_vat_id": result.customer_vat_id,  # DIČ odběratele
             "processed_date": result.processed_date.isoformat(),  # Datum zpracování
             "confidence_score": result.confidence_score,  # Skóre spolehlivosti
-            "llm_model_used": result.llm_model_used  # Použitý AI model
+            "llm_model_used": result.llm_model_used,  # Použitý AI model
+            "routing_decision": result.routing_decision,  # Rozhodnutí směrování mezi modely
+            "escalated_fields": result.escalated_fields.split(",") if result.escalated_fields else [],  # Eskalovaná pole
+            "llm_calls": json.loads(result.llm_calls) if result.llm_calls else [],  # Jednotlivá volání modelů
+            "llm_latency_ms": result.llm_latency_ms,  # Celková doba volání modelů
+            "llm_tokens": result.llm_tokens  # Celkový počet tokenů
         }
-        return result_dict  # Vrácení výsledku jako JSON
+        return JSONResponse(result_dict, headers=headers)  # Vrácení výsledku jako JSON
     else:
         # Pokud výsledek ještě neexistuje, vrátíme informaci o zpracování
-        return {"status": "processing", "upload_id": upload_id}
+        return JSONResponse(
+            {"status": "processing", "upload_id": upload_id},
+            headers={"Cache-Control": "no-store"}  # Stav zpracování se nesmí cachovat
+        )
@@ -5,23 +5,19 @@ from fastapi import APIRouter, UploadFile, File, Depends, HTTPException, Request
 from fastapi.responses import HTMLResponse  # Pro vrácení HTML odpovědí
 from fastapi.templating import Jinja2Templates  # Pro práci s šablonami
 from sqlmodel import Session, select  # Pro práci s databází
-from pathlib import Path  # Pro práci s cestami k souborům
 import os  # Pro práci se soubory
-import shutil  # Pro kopírování souborů
-import uuid  # Pro generování unikátních ID
 from datetime import datetime  # Pro práci s datem a časem
 
 # Import modelů a funkcí
 from models.upload import Upload  # Model pro nahrané soubory
 from database import get_session  # Funkce pro získání databázové session
+from static_files import static_url  # URL statických souborů s otiskem
+from storage import store_file  # Uložení souboru do úložiště
 
 # Vytvoření routeru a šablon
 router = APIRouter()  # Router pro registraci endpointů
 templates = Jinja2Templates(directory="templates")  # Šablony z adresáře templates
-
-# Adresář pro ukládání nahraných souborů
-UPLOAD_DIR = Path("uploads")  # Cesta k adresáři
-UPLOAD_DIR.mkdir(exist_ok=True)  # Vytvoření adresáře (pokud již existuje, nic se nestane)
+templates.env.globals["static_url"] = static_url  # Funkce pro odkazy na statické soubory v šablonách
 
 @router.get("/", response_class=HTMLResponse)
 async def upload_form(request: Request):
@@ -49,24 +45,17 @@ async def upload_file(
         # Pokud není typ souboru povolen, vrátíme chybu 400
         raise HTTPException(status_code=400, detail="Jsou povoleny pouze soubory PDF a obrázky")
     
-    # Vytvoření unikátního názvu souboru
+    # Uložení souboru do úložiště (název a umístění určuje otisk obsahu)
     file_ext = os.path.splitext(file.filename)[1]  # Získání přípony souboru
-    unique_filename = f"{uuid.uuid4()}{file_ext}"  # Generování unikátního názvu pomocí UUID
-    file_path = UPLOAD_DIR / unique_filename  # Sestavení kompletní cesty k souboru
-    
-    # Uložení souboru na disk
-    with open(file_path, "wb") as buffer:  # Otevření souboru pro zápis v binárním režimu
-        shutil.copyfileobj(file.file, buffer)  # Kopírování obsahu souboru
-    
-    # Získání velikosti souboru v bajtech
-    file_size = os.path.getsize(file_path)
+    file_path, file_size, content_hash = store_file(file.file, file_ext)
     
     # Vytvoření záznamu v databázi
     upload = Upload(
-        filename=unique_filename,  # Unikátní název souboru v systému
+        filename=os.path.basename(file_path),  # Název souboru v úložišti
         original_filename=file.filename,  # Původní název souboru od uživatele
-        file_path=str(file_path),  # Cesta k souboru na disku
-        file_size=file_size,  # Velikost souboru v bajtech
+        file_path=file_path,  # Cesta k souboru na disku
+        file_size=file_size,  # Velikost souboru v bajtech (před kompresí)
+        content_hash=content_hash,  # Otisk obsahu souboru
         mime_type=content_type,  # MIME typ souboru
         upload_date=datetime.now(),  # Aktuální datum a čas
         processed=False  # Indikace, že soubor ještě nebyl zpracován
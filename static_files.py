@@ -0,0 +1,56 @@
+# Obsluha statických souborů s otisky (fingerprinting) a dlouhodobým cachováním
+
+# Import potřebných knihoven
+from fastapi.staticfiles import StaticFiles  # Pro obsluhu statických souborů
+from functools import lru_cache  # Pro cachování otisků souborů
+from pathlib import Path  # Pro práci s cestami k souborům
+import hashlib  # Pro výpočet otisku obsahu souboru
+from urllib.parse import parse_qs  # Pro čtení parametrů URL
+
+# Adresář se statickými soubory a URL, na které jsou dostupné
+STATIC_DIR = Path("static")
+STATIC_URL = "/static"
+
+# Hlavička pro soubory s otiskem v URL - jejich obsah se pod danou URL nikdy nezmění
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+@lru_cache(maxsize=None)
+def file_fingerprint(path: str) -> str:
+    """Vrátí krátký otisk obsahu statického souboru
+
+    Otisk se počítá jen jednou za běh procesu; po změně souborů
+    se aplikace restartuje (případně automaticky díky --reload).
+    """
+    file_path = STATIC_DIR / path.lstrip("/")
+    try:
+        return hashlib.md5(file_path.read_bytes()).hexdigest()[:12]
+    except OSError:
+        return ""  # Neexistující soubor - URL bez otisku
+
+def static_url(path: str) -> str:
+    """Vrátí URL statického souboru s otiskem obsahu (např. /static/css/styles.css?v=1a2b3c)
+
+    Používá se v šablonách místo url_for('static', ...), aby prohlížeč mohl
+    soubor cachovat natrvalo a po změně obsahu si stáhl novou verzi.
+    """
+    fingerprint = file_fingerprint(path)
+    url = f"{STATIC_URL}/{path.lstrip('/')}"
+    return f"{url}?v={fingerprint}" if fingerprint else url
+
+class CachedStaticFiles(StaticFiles):
+    """Statické soubory s dlouhodobou cache pro URL s otiskem
+
+    Soubory požadované s parametrem ?v= shodným s aktuálním otiskem (viz static_url)
+    dostanou hlavičku immutable, ostatní se musí při každém použití ověřit
+    (ETag od StaticFiles).
+    """
+    async def get_response(self, path: str, scope):
+        response = await super().get_response(path, scope)  # Standardní odpověď StaticFiles
+        if response.status_code in (200, 304):
+            query = parse_qs(scope.get("query_string", b"").decode("latin-1"))  # Parametry URL
+            fingerprint = file_fingerprint(path)
+            if fingerprint and query.get("v") == [fingerprint]:
+                response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+            else:
+                response.headers["Cache-Control"] = "no-cache"
+        return response
@@ -0,0 +1,385 @@
+# Úložiště nahraných souborů - rozdělení do podadresářů, komprese, deduplikace a úklid
+
+# Import potřebných knihoven
+from sqlmodel import Session, select, func  # Pro práci s databází
+from contextlib import contextmanager  # Pro dočasné soubory a adresáře
+from datetime import datetime, timedelta  # Pro práci s datem a časem
+from pathlib import Path  # Pro práci s cestami k souborům
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple  # Typové anotace
+import argparse  # Pro zpracování parametrů příkazové řádky
+import gzip  # Pro kompresi originálů
+import hashlib  # Pro výpočet otisku obsahu
+import json  # Pro výpis přehledu ve formátu JSON
+import logging  # Pro logování událostí
+import os  # Pro práci se soubory
+import shutil  # Pro kopírování a mazání souborů
+import tempfile  # Pro dočasné soubory
+import time  # Pro stáří dočasných souborů
+
+# Import modelů a funkcí
+from models.upload import Upload  # Model pro nahrané soubory
+from models.result import InvoiceResult  # Model pro výsledky zpracování
+from database import engine, create_db_and_tables  # Databázový engine a vytvoření tabulek
+
+logger = logging.getLogger(__name__)  # Vytvoření loggeru pro tento soubor
+
+# Adresář pro ukládání nahraných souborů
+UPLOAD_DIR = Path("uploads")
+# Adresář pro dočasné soubory (rozpracované nahrávání, obrázky z PDF pro OCR)
+STORAGE_TMP_DIR = UPLOAD_DIR / "tmp"
+
+# Ukládat originály komprimované pomocí gzip (pouze pokud to ušetří alespoň 10 % místa)
+STORAGE_COMPRESS = os.environ.get("STORAGE_COMPRESS", "0") == "1"
+# Počet dní po úspěšném zpracování, po kterých se smaže originál (prázdné = uchovávat navždy)
+STORAGE_RETENTION_DAYS = int(os.environ["STORAGE_RETENTION_DAYS"]) if os.environ.get("STORAGE_RETENTION_DAYS") else None
+# Doba v hodinách, po které se neodkazované a dočasné soubory považují za opuštěné
+STORAGE_GC_GRACE_HOURS = float(os.environ.get("STORAGE_GC_GRACE_HOURS", "1"))
+# Interval v hodinách, ve kterém služba ingest spouští úklid a uchovávání (viz run_maintenance)
+STORAGE_MAINTENANCE_HOURS = float(os.environ.get("STORAGE_MAINTENANCE_HOURS", "6"))
+
+def shard_path(content_hash: str, suffix: str) -> Path:
+    """Vrátí cestu k souboru v úložišti rozděleném podle prefixu otisku
+
+    Např. uploads/3f/a2/3fa2...c9.pdf - v jednom adresáři je tak nejvýše
+    256 podadresářů a soubory se rozloží rovnoměrně.
+    """
+    return UPLOAD_DIR / content_hash[:2] / content_hash[2:4] / f"{content_hash}{suffix.lower()}"
+
+def store_file(source: BinaryIO, suffix: str) -> Tuple[str, int, str]:
+    """Uloží obsah souboru do úložiště a vrátí (cesta, velikost v bajtech, otisk obsahu)
+
+    Soubor se stejným obsahem se ukládá jen jednou - pokud už v úložišti je,
+    vrátí se cesta k existujícímu souboru. Ten se "dotkne" (aktualizuje se čas
+    změny), aby ho úklid ani uchovávání nesmazaly dřív, než na něj začne
+    odkazovat nový záznam v databázi.
+    """
+    STORAGE_TMP_DIR.mkdir(parents=True, exist_ok=True)
+    digest = hashlib.sha256()  # Otisk počítaný průběžně při zápisu
+    size = 0
+
+    # Zápis do dočasného souboru (otisk a tím i cílová cesta jsou známé až na konci)
+    with tempfile.NamedTemporaryFile(dir=STORAGE_TMP_DIR, delete=False) as temp_file:
+        for chunk in iter(lambda: source.read(1024 * 1024), b""):
+            digest.update(chunk)
+            temp_file.write(chunk)
+            size += len(chunk)
+
+    content_hash = digest.hexdigest()
+    raw_path = shard_path(content_hash, suffix)
+    compressed_path = raw_path.with_name(raw_path.name + ".gz")
+
+    # Deduplikace - stejný obsah už je uložen
+    for existing in (raw_path, compressed_path):
+        if existing.exists():
+            os.unlink(temp_file.name)
+            os.utime(existing)  # Ochranná lhůta pro úklid začíná znovu
+            return str(existing), size, content_hash
+
+    raw_path.parent.mkdir(parents=True, exist_ok=True)
+    if STORAGE_COMPRESS and compress_file(temp_file.name, compressed_path, size):
+        os.unlink(temp_file.name)
+        return str(compressed_path), size, content_hash
+
+    os.replace(temp_file.name, raw_path)  # Atomický přesun na cílové místo
+    return str(raw_path), size, content_hash
+
+def compress_file(source_path: str, target_path: Path, size: int) -> bool:
+    """Zkomprimuje soubor pomocí gzip; vrátí False, pokud komprese neušetří alespoň 10 %"""
+    temp_target = target_path.with_name(target_path.name + ".part")
+    with open(source_path, "rb") as source, gzip.open(temp_target, "wb") as target:
+        shutil.copyfileobj(source, target)
+
+    if temp_target.stat().st_size > size * 0.9:
+        os.unlink(temp_target)  # Např. PDF nebo JPEG jsou už komprimované
+        return False
+
+    os.replace(temp_target, target_path)
+    return True
+
+@contextmanager
+def temp_dir() -> Iterator[Path]:
+    """Vytvoří dočasný adresář v úložišti, který se po použití vždy smaže
+
+    Dočasné soubory po spadlém procesu odstraní collect_garbage().
+    """
+    STORAGE_TMP_DIR.mkdir(parents=True, exist_ok=True)
+    path = Path(tempfile.mkdtemp(dir=STORAGE_TMP_DIR))
+    try:
+        yield path
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+@contextmanager
+def local_file(file_path: str) -> Iterator[str]:
+    """Zpřístupní uložený soubor jako běžný soubor na disku (komprimovaný rozbalí do dočasného adresáře)"""
+    if not file_path.endswith(".gz"):
+        yield file_path
+        return
+
+    with temp_dir() as directory:
+        local_path = directory / Path(file_path).stem  # Název bez přípony .gz (např. abc.pdf)
+        with gzip.open(file_path, "rb") as source, open(local_path, "wb") as target:
+            shutil.copyfileobj(source, target)
+        yield str(local_path)
+
+def referenced_paths(session: Session) -> set:
+    """Vrátí cesty souborů, na které odkazuje některý nahraný soubor s neodstraněným originálem"""
+    paths = session.exec(select(Upload.file_path).where(Upload.file_purged_date == None)).all()  # noqa: E711
+    return {str(Path(path)) for path in paths}
+
+def iter_stored_files() -> Iterator[Path]:
+    """Projde všechny uložené soubory (adresář s dočasnými soubory se vůbec neprochází)"""
+    for directory, subdirectories, filenames in os.walk(UPLOAD_DIR):
+        if Path(directory) == UPLOAD_DIR and STORAGE_TMP_DIR.name in subdirectories:
+            subdirectories.remove(STORAGE_TMP_DIR.name)  # Dočasné soubory spravuje collect_garbage zvlášť
+        for filename in filenames:
+            if not filename.startswith("."):
+                yield Path(directory) / filename
+
+def is_stale(path: Path, grace_hours: float) -> bool:
+    """Zjistí, zda se soubor nezměnil déle než grace_hours hodin"""
+    return time.time() - path.stat().st_mtime > grace_hours * 3600
+
+def collect_garbage(grace_hours: float = STORAGE_GC_GRACE_HOURS, dry_run: bool = False) -> Tuple[int, int]:
+    """Smaže neodkazované soubory v úložišti a opuštěné dočasné soubory
+
+    Smažou se jen soubory starší než grace_hours, aby se nesmazalo
+    právě probíhající nahrávání. Vrátí (počet smazaných položek, uvolněné bajty).
+    """
+    with Session(engine) as session:
+        referenced = referenced_paths(session)
+
+    removed, freed = 0, 0
+
+    # Soubory, na které už neodkazuje žádný záznam v databázi
+    for path in iter_stored_files():
+        try:
+            if str(path) in referenced or not is_stale(path, grace_hours):
+                continue
+            size = path.stat().st_size
+            logger.info(f"Orphaned file {path} ({size} B)")
+            if not dry_run:
+                path.unlink()
+        except FileNotFoundError:
+            continue  # Soubor mezitím smazal nebo přesunul jiný proces
+        removed, freed = removed + 1, freed + size
+
+    # Dočasné soubory a adresáře po přerušeném nahrávání nebo zpracování
+    if STORAGE_TMP_DIR.exists():
+        for path in STORAGE_TMP_DIR.iterdir():
+            try:
+                if not is_stale(path, grace_hours):
+                    continue
+                size = path.stat().st_size if path.is_file() else sum(f.stat().st_size for f in path.rglob("*") if f.is_file())
+                logger.info(f"Stale temporary {path} ({size} B)")
+                if not dry_run:
+                    if path.is_dir():
+                        shutil.rmtree(path, ignore_errors=True)
+                    else:
+                        path.unlink()
+            except FileNotFoundError:
+                continue  # Dočasný soubor mezitím uklidil proces, který ho vytvořil
+            removed, freed = removed + 1, freed + size
+
+    return removed, freed
+
+def apply_retention(days: int, dry_run: bool = False, grace_hours: float = STORAGE_GC_GRACE_HOURS) -> Tuple[int, int]:
+    """Smaže originály souborů zpracovaných před více než `days` dny
+
+    Extrahovaný text a výsledky zpracování zůstávají v databázi, u nahraného
+    souboru se jen vyplní file_purged_date. Sdílený (deduplikovaný) soubor se
+    smaže, až když jeho lhůta uplyne u všech nahrání, která na něj odkazují.
+    Soubory změněné v posledních grace_hours hodinách (např. znovu nahrané
+    a ještě neuložené v databázi) se přeskočí.
+    Vrátí (počet smazaných souborů, uvolněné bajty).
+    """
+    cutoff = datetime.now() - timedelta(days=days)
+
+    with Session(engine) as session:
+        # Datum posledního zpracování každého nahraného souboru
+        last_processed = dict(session.exec(
+            select(InvoiceResult.upload_id, func.max(InvoiceResult.processed_date)).group_by(InvoiceResult.upload_id)
+        ).all())
+
+        uploads = session.exec(select(Upload).where(Upload.file_purged_date == None)).all()  # noqa: E711
+        expired: Dict[str, List[Upload]] = {}
+        kept = set()
+        for upload in uploads:
+            processed_date = last_processed.get(upload.id)
+            if upload.processed and processed_date and processed_date < cutoff:
+                expired.setdefault(upload.file_path, []).append(upload)
+            else:
+                kept.add(upload.file_path)
+
+        removed, freed = 0, 0
+        now = datetime.now()
+        for file_path, expired_uploads in expired.items():
+            if file_path in kept:
+                continue  # Soubor ještě potřebuje jiné nahrání
+
+            path = Path(file_path)
+            if path.exists() and not is_stale(path, grace_hours):
+                continue  # Soubor byl právě znovu nahrán
+
+            # Kontrola odkazů těsně před smazáním (mezitím mohlo vzniknout nové nahrání)
+            expired_ids = [upload.id for upload in expired_uploads]
+            new_reference = session.exec(
+                select(Upload.id).where(
+                    Upload.file_path == file_path,
+                    Upload.file_purged_date == None,  # noqa: E711
+                    Upload.id.not_in(expired_ids)
+                )
+            ).first()
+            if new_reference is not None:
+                continue
+
+            if path.exists():
+                size = path.stat().st_size
+                logger.info(f"Retention: removing {path} ({size} B)")
+                if not dry_run:
+                    path.unlink()
+                removed, freed = removed + 1, freed + size
+
+            if not dry_run:
+                for upload in expired_uploads:
+                    upload.file_purged_date = now
+                    session.add(upload)
+
+        session.commit()
+
+    return removed, freed
+
+def run_maintenance(retention_days: Optional[int] = STORAGE_RETENTION_DAYS) -> None:
+    """Spustí úklid úložiště a (je-li nastavena lhůta) smazání starých originálů
+
+    Volá se pravidelně ze služby ingest; bez ní je potřeba spouštět
+    příkazy storage.py gc a retention např. pomocí cronu.
+    """
+    try:
+        if retention_days is not None:
+            removed, freed = apply_retention(retention_days)
+            logger.info(f"Retention removed {removed} originals, freed {freed} B")
+        removed, freed = collect_garbage()
+        logger.info(f"Garbage collection removed {removed} items, freed {freed} B")
+    except Exception as e:
+        logger.error(f"Error during storage maintenance: {e}")
+
+def disk_usage() -> Dict[str, Dict[str, int]]:
+    """Vrátí využití disku podle stavu souborů
+
+    Stavy: processed (zpracované), pending (čekající na zpracování),
+    purged (originál smazán podle pravidel uchovávání), orphaned (bez záznamu
+    v databázi) a temp (dočasné soubory). Sdílený soubor se započítá jednou.
+    """
+    usage = {status: {"files": 0, "bytes": 0} for status in ("processed", "pending", "purged", "orphaned", "temp")}
+    counted = set()
+
+    with Session(engine) as session:
+        for upload in session.exec(select(Upload)).all():
+            if upload.file_purged_date:
+                usage["purged"]["files"] += 1  # Originál už na disku není
+                continue
+
+            path = str(Path(upload.file_path))
+            if path in counted or not os.path.exists(path):
+                continue
+            counted.add(path)
+
+            status = "processed" if upload.processed else "pending"
+            usage[status]["files"] += 1
+            usage[status]["bytes"] += os.path.getsize(path)
+
+    for path in iter_stored_files():
+        if str(path) not in counted:
+            try:
+                size = path.stat().st_size
+            except FileNotFoundError:
+                continue  # Soubor byl mezitím smazán
+            usage["orphaned"]["files"] += 1
+            usage["orphaned"]["bytes"] += size
+
+    if STORAGE_TMP_DIR.exists():
+        for path in STORAGE_TMP_DIR.rglob("*"):
+            if path.is_file():
+                usage["temp"]["files"] += 1
+                usage["temp"]["bytes"] += path.stat().st_size
+
+    return usage
+
+def migrate_flat_files(dry_run: bool = False) -> int:
+    """Přesune soubory uložené přímo v adresáři uploads do rozděleného úložiště
+
+    Vrátí počet přesunutých souborů.
+    """
+    migrated = 0
+
+    with Session(engine) as session:
+        uploads = session.exec(select(Upload).where(Upload.file_purged_date == None)).all()  # noqa: E711
+        for upload in uploads:
+            old_path = Path(upload.file_path)
+            if old_path.parent != UPLOAD_DIR or not old_path.exists():
+                continue  # Už je v rozděleném úložišti nebo soubor chybí
+
+            logger.info(f"Migrating {old_path}")
+            if dry_run:
+                migrated += 1
+                continue
+
+            with open(old_path, "rb") as source:
+                file_path, _, content_hash = store_file(source, old_path.suffix)
+
+            upload.file_path = file_path
+            upload.filename = Path(file_path).name
+            upload.content_hash = content_hash
+            session.add(upload)
+            session.commit()  # Potvrzení před smazáním starého souboru
+            old_path.unlink()
+            migrated += 1
+
+    return migrated
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the uploads storage")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    subparsers.add_parser("usage", help="Report disk usage by status").add_argument(
+        "--json", action="store_true", help="Print the report as JSON"
+    )
+    gc_parser = subparsers.add_parser("gc", help="Remove orphaned files and stale temporary files")
+    gc_parser.add_argument("--grace-hours", type=float, default=STORAGE_GC_GRACE_HOURS, help="Minimum age of removed files")
+    retention_parser = subparsers.add_parser("retention", help="Remove originals of invoices processed long ago")
+    retention_parser.add_argument("--days", type=int, default=STORAGE_RETENTION_DAYS, help="Days to keep originals after processing")
+    migrate_parser = subparsers.add_parser("migrate", help="Move files from the flat uploads directory into the sharded layout")
+    for subparser in (gc_parser, retention_parser, migrate_parser):
+        subparser.add_argument("--dry-run", action="store_true", help="Only report what would be done")
+
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler("app.log"),
+            logging.StreamHandler()
+        ]
+    )
+
+    create_db_and_tables()  # Doplnění nových sloupců do existující databáze
+
+    if args.command == "usage":
+        usage = disk_usage()
+        if args.json:
+            print(json.dumps(usage, indent=2))
+        else:
+            for status, values in usage.items():
+                print(f"{status:<10} {values['files']:>8} files {values['bytes'] / 1024 / 1024:>12.1f} MB")
+    elif args.command == "gc":
+        removed, freed = collect_garbage(args.grace_hours, args.dry_run)
+        print(f"Removed {removed} items, freed {freed / 1024 / 1024:.1f} MB")
+    elif args.command == "retention":
+        if args.days is None:
+            parser.error("set --days or STORAGE_RETENTION_DAYS")
+        removed, freed = apply_retention(args.days, args.dry_run)
+        print(f"Removed {removed} originals, freed {freed / 1024 / 1024:.1f} MB")
+    elif args.command == "migrate":
+        print(f"Migrated {migrate_flat_files(args.dry_run)} files")
@@ -1,11 +1,14 @@
 import os
 import json
+import time
+import threading
 import requests
 from datetime import datetime
 import tempfile
 import mimetypes
 import logging
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Tuple
+from concurrent.futures import Future
 import re
 
 # For PDF processing
@@ -18,22 +21,48 @@ from sqlmodel import Session
 from models.upload import Upload
 from models.result import InvoiceResult
 from database import engine
+from storage import local_file, temp_dir
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("app.log"),
-        logging.StreamHandler()
-    ]
-)
+# Logging is configured by the entry point (main.py)
 logger = logging.getLogger(__name__)
 
 # Ollama API settings
 OLLAMA_HOST = os.environ.get("OLLAMA_HOST", "http://localhost:11434")
 OLLAMA_API_URL = f"{OLLAMA_HOST}/api/generate"
 
+# Model routing settings: the fast model is tried first and only fields that
+# fail validation are escalated to the requested (larger) model.
+# An empty OLLAMA_FAST_MODEL disables the cascade.
+OLLAMA_FAST_MODEL = os.environ.get("OLLAMA_FAST_MODEL", "llama3.2")
+# Below this confidence the whole document is re-extracted by the larger model
+DOCUMENT_ESCALATION_THRESHOLD = float(os.environ.get("DOCUMENT_ESCALATION_THRESHOLD", "0.5"))
+
+# Micro-batching of short documents into one Ollama request.
+# LLM_BATCH_MAX_DOCS=1 disables batching.
+LLM_BATCH_MAX_DOCS = int(os.environ.get("LLM_BATCH_MAX_DOCS", "4"))
+LLM_BATCH_WAIT_MS = int(os.environ.get("LLM_BATCH_WAIT_MS", "200"))
+# Estimated input tokens of all documents in one batch
+LLM_BATCH_TOKEN_BUDGET = int(os.environ.get("LLM_BATCH_TOKEN_BUDGET", "1500"))
+
+# Fields extracted from an invoice and their description for the LLM prompt
+INVOICE_FIELDS = {
+    "invoice_number": "The invoice number/ID",
+    "invoice_date": "The date when the invoice was issued (YYYY-MM-DD)",
+    "due_date": "The payment due date (YYYY-MM-DD)",
+    "total_amount": "The total amount to be paid (numeric value only)",
+    "vat_amount": "The VAT/tax amount (numeric value only)",
+    "currency": "The currency code (e.g., CZK, EUR, USD)",
+    "supplier_name": "The name of the supplier/seller",
+    "supplier_tax_id": "The tax ID of the supplier (IČO in Czech Republic)",
+    "supplier_vat_id": "The VAT ID of the supplier (DIČ in Czech Republic)",
+    "customer_name": "The name of the customer/buyer",
+    "customer_tax_id": "The tax ID of the customer (IČO in Czech Republic)",
+    "customer_vat_id": "The VAT ID of the customer (DIČ in Czech Republic)",
+}
+
+# Fields every invoice must have; the rest are only validated when present
+REQUIRED_FIELDS = ("invoice_number", "invoice_date", "total_amount", "currency", "supplier_name")
+
 def get_mime_type(file_path: str) -> str:
     """Get MIME type of a file"""
     mime_type, _ = mimetypes.guess_type(file_path)
@@ -65,8 +94,8 @@ def extract_text_from_image(image_path: str) -> str:
         logger.error(f"Error extracting text from image: {e}")
         return ""
 
-def extract_images_from_pdf(pdf_path: str) -> List[str]:
-    """Extract images from PDF and save them to temporary files"""
+def extract_images_from_pdf(pdf_path: str, output_dir: Optional[str] = None) -> List[str]:
+    """Extract images from PDF and save them to temporary files in output_dir"""
     image_paths = []
     
     try:
@@ -83,7 +112,7 @@ def extract_images_from_pdf(pdf_path: str) -> List[str]:
                     image_bytes = base_image["image"]
                     
                     # Save image to temporary file
-                    with tempfile.NamedTemporaryFile(delete=False, suffix=".png") as temp_file:
+                    with tempfile.NamedTemporaryFile(delete=False, suffix=".png", dir=output_dir) as temp_file:
                         temp_file.write(image_bytes)
                         image_paths.append(temp_file.name)
     
@@ -92,7 +121,34 @@ def extract_images_from_pdf(pdf_path: str) -> List[str]:
     
     return image_paths
 
-def process_invoice(upload_id: int, file_path: str, model: str = "llama3") -> None:
+def extract_text(file_path: str) -> str:
+    """Extract text from a stored invoice file based on its type"""
+    # Stored originals may be compressed; temporary images are removed even if OCR fails
+    with local_file(file_path) as local_path, temp_dir() as image_dir:
+        mime_type = get_mime_type(local_path)
+        extracted_text = ""
+        
+        if mime_type.startswith("application/pdf"):
+            # Extract text from PDF
+            pdf_text = extract_text_from_pdf(local_path)
+            extracted_text += pdf_text
+            
+            # If text is too short, try extracting from images in the PDF
+            if len(pdf_text.strip()) < 100:
+                logger.info("PDF text is short, extracting images from PDF")
+                image_paths = extract_images_from_pdf(local_path, str(image_dir))
+                
+                for img_path in image_paths:
+                    img_text = extract_text_from_image(img_path)
+                    extracted_text += f"\n\n{img_text}"
+        
+        elif mime_type.startswith("image/"):
+            # Extract text from image
+            extracted_text = extract_text_from_image(local_path)
+        
+        return extracted_text
+
+def process_invoice(upload_id: int, file_path: str, model: str = "llama3", fast_model: Optional[str] = None) -> None:
     """Process an invoice file using OCR and LLM"""
     try:
         # Get session
@@ -103,37 +159,11 @@ def process_invoice(upload_id: int, file_path: str, model: str = "llama3") -> No
                 logger.error(f"Upload {upload_id} not found")
                 return
             
-            # Extract text based on file type
-            mime_type = get_mime_type(file_path)
-            extracted_text = ""
-            
-            if mime_type.startswith("application/pdf"):
-                # Extract text from PDF
-                pdf_text = extract_text_from_pdf(file_path)
-                extracted_text += pdf_text
-                
-                # If text is too short, try extracting from images in the PDF
-                if len(pdf_text.strip()) < 100:
-                    logger.info("PDF text is short, extracting images from PDF")
-                    image_paths = extract_images_from_pdf(file_path)
-                    
-                    for img_path in image_paths:
-                        img_text = extract_text_from_image(img_path)
-                        extracted_text += f"\n\n{img_text}"
-                        
-                        # Clean up temporary image file
-                        try:
-                            os.unlink(img_path)
-                        except Exception:
-                            pass
-            
-            elif mime_type.startswith("image/"):
-                # Extract text from image
-                extracted_text = extract_text_from_image(file_path)
+            extracted_text = extract_text(file_path)
             
             # Process extracted text with LLM
             if extracted_text:
-                invoice_data = process_text_with_llm(extracted_text, model)
+                invoice_data, routing = extract_invoice_data(extracted_text, model, fast_model)
                 
                 # Create result
                 result = InvoiceResult(
@@ -151,8 +181,7 @@ def process_invoice(upload_id: int, file_path: str, model: str = "llama3") -> No
                     customer_tax_id=invoice_data.get("customer_tax_id"),
                     customer_vat_id=invoice_data.get("customer_vat_id"),
                     raw_text=extracted_text,
-                    llm_model_used=model,
-                    confidence_score=invoice_data.get("confidence_score", 0.7)
+                    **routing
                 )
                 
                 session.add(result)
@@ -162,32 +191,91 @@ def process_invoice(upload_id: int, file_path: str, model: str = "llama3") -> No
                 session.add(upload)
                 
                 session.commit()
-                logger.info(f"Invoice {upload_id} processed successfully")
+                logger.info(f"Invoice {upload_id} processed successfully ({result.routing_decision})")
             else:
                 logger.error(f"No text extracted from file {file_path}")
     
     except Exception as e:
         logger.error(f"Error processing invoice: {e}")
 
-def process_text_with_llm(text: str, model: str) -> Dict[str, Any]:
-    """Process extracted text with LLM to extract invoice data"""
-    try:
-        # Prepare prompt for the LLM
-        prompt = f"""
+def extract_invoice_data(text: str, model: str, fast_model: Optional[str] = None) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """Extract invoice data, trying the fast model first and escalating to `model` on failed validation
+    
+    Returns the invoice data and the routing record (InvoiceResult column values).
+    """
+    if fast_model is None:
+        fast_model = OLLAMA_FAST_MODEL
+    
+    calls = []
+    escalated: List[str] = []
+    
+    if not fast_model or fast_model == model:
+        # No cascade, use the requested model only
+        invoice_data, model_calls = extract_with_model(text, model)
+        calls.extend(model_calls)
+        decision = "single"
+        models_used = model
+    else:
+        invoice_data, model_calls = extract_with_model(text, fast_model)
+        calls.extend(model_calls)
+        confidence, invalid_fields = validate_invoice_data(invoice_data)
+        models_used = fast_model
+        
+        if not invalid_fields:
+            decision = "fast"
+        else:
+            if confidence < DOCUMENT_ESCALATION_THRESHOLD:
+                # Fast model mostly failed, re-extract the whole document
+                decision = "escalated_document"
+                escalated = list(INVOICE_FIELDS)
+            else:
+                # Only ask the larger model for the fields that failed
+                decision = "escalated_fields"
+                escalated = invalid_fields
+            
+            logger.info(f"Escalating {decision} to {model}: {', '.join(escalated)}")
+            large_data, model_calls = extract_with_model(text, model, escalated)
+            calls.extend(model_calls)
+            invoice_data = merge_invoice_data(invoice_data, large_data, escalated)
+            models_used = f"{fast_model}+{model}"
+    
+    confidence, _ = validate_invoice_data(invoice_data)
+    routing = {
+        "llm_model_used": models_used,
+        "confidence_score": confidence,
+        "routing_decision": decision,
+        "escalated_fields": ",".join(escalated) or None,
+        "llm_calls": json.dumps(calls),
+        "llm_latency_ms": round(sum(call["latency_ms"] for call in calls), 1),
+        "llm_tokens": sum(call["prompt_tokens"] + call["completion_tokens"] for call in calls),
+    }
+    return invoice_data, routing
+
+def merge_invoice_data(base: Dict[str, Any], escalated_data: Dict[str, Any], fields: List[str]) -> Dict[str, Any]:
+    """Merge escalated field values into base data, keeping base values the larger model did not improve"""
+    candidate = dict(base)
+    candidate.update({field: escalated_data.get(field) for field in fields})
+    _, invalid_fields = validate_invoice_data(candidate)
+    
+    merged = dict(base)
+    for field in fields:
+        if field not in invalid_fields or base.get(field) is None:
+            merged[field] = escalated_data.get(field)
+    
+    return merged
+
+def format_field_list(fields: Optional[List[str]] = None) -> str:
+    """Format the requested invoice fields with their descriptions for a prompt"""
+    return "\n".join(
+        f"        - {field}: {INVOICE_FIELDS[field]}" for field in (fields or INVOICE_FIELDS)
+    )
+
+def build_extraction_prompt(text: str, fields: Optional[List[str]] = None) -> str:
+    """Build the LLM prompt asking for the given invoice fields (all fields by default)"""
+    field_lines = format_field_list(fields)
+    return f"""
         Analyze the following invoice text and extract these fields in JSON format:
-        - invoice_number: The invoice number/ID
-        - invoice_date: The date when the invoice was issued (YYYY-MM-DD)
-        - due_date: The payment due date (YYYY-MM-DD)
-        - total_amount: The total amount to be paid (numeric value only)
-        - vat_amount: The VAT/tax amount (numeric value only)
-        - currency: The currency code (e.g., CZK, EUR, USD)
-        - supplier_name: The name of the supplier/seller
-        - supplier_tax_id: The tax ID of the supplier (IČO in Czech Republic)
-        - supplier_vat_id: The VAT ID of the supplier (DIČ in Czech Republic)
-        - customer_name: The name of the customer/buyer
-        - customer_tax_id: The tax ID of the customer (IČO in Czech Republic)
-        - customer_vat_id: The VAT ID of the customer (DIČ in Czech Republic)
-        - confidence_score: Your confidence in the extraction (0.0 to 1.0)
+{field_lines}
         
         For each field, if you cannot find the information, set it to null.
         Return only valid JSON without any additional text.
@@ -195,8 +283,31 @@ def process_text_with_llm(text: str, model: str) -> Dict[str, Any]:
         INVOICE TEXT:
         {text}
         """
+
+def build_batch_extraction_prompt(documents: Dict[str, str], fields: Optional[List[str]] = None) -> str:
+    """Build one LLM prompt asking for the given fields of several invoices keyed by document ID"""
+    field_lines = format_field_list(fields)
+    document_blocks = "\n\n".join(
+        f"=== DOCUMENT {document_id} ===\n{text}" for document_id, text in documents.items()
+    )
+    return f"""
+        Analyze the following invoice texts. Each invoice starts with a line "=== DOCUMENT <id> ===".
+        For every invoice extract these fields:
+        - document_id: The <id> of the invoice
+{field_lines}
         
-        # Call Ollama API
+        For each field, if you cannot find the information, set it to null.
+        Return only a valid JSON array with one object per invoice without any additional text.
+        
+{document_blocks}
+        """
+
+def call_ollama(prompt: str, model: str) -> Tuple[Optional[str], Dict[str, Any]]:
+    """Send a prompt to Ollama, return the response text and call statistics"""
+    stats = {"model": model, "latency_ms": 0.0, "gpu_ms": 0.0, "prompt_tokens": 0, "completion_tokens": 0, "ok": False}
+    started = time.perf_counter()
+    
+    try:
         response = requests.post(
             OLLAMA_API_URL,
             json={
@@ -205,31 +316,215 @@ def process_text_with_llm(text: str, model: str) -> Dict[str, Any]:
                 "stream": False
             }
         )
+    except Exception as e:
+        logger.error(f"Error calling Ollama model {model}: {e}")
+        stats["latency_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        return None, stats
+    
+    stats["latency_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    
+    if response.status_code != 200:
+        logger.error(f"Ollama API error: {response.status_code} - {response.text}")
+        return None, stats
+    
+    response_data = response.json()
+    stats["ok"] = True
+    stats["gpu_ms"] = round(response_data.get("total_duration", 0) / 1e6, 1)
+    stats["prompt_tokens"] = response_data.get("prompt_eval_count", 0)
+    stats["completion_tokens"] = response_data.get("eval_count", 0)
+    return response_data.get("response", ""), stats
+
+def parse_llm_json(llm_response: str) -> Any:
+    """Parse JSON from an LLM response, raises json.JSONDecodeError"""
+    # Find JSON in the response (it might be surrounded by markdown code blocks or other text)
+    json_match = re.search(r'```json\s*([\s\S]*?)\s*```|^\s*(\{[\s\S]*\}|\[[\s\S]*\])\s*$', llm_response)
+    
+    if json_match:
+        json_str = json_match.group(1) or json_match.group(2)
+        return json.loads(json_str)
+    
+    # Try to parse the entire response as JSON
+    return json.loads(llm_response)
+
+def estimate_tokens(text: str) -> int:
+    """Roughly estimate the number of LLM tokens in a text"""
+    return len(text) // 4 + 1
+
+def extract_with_model(text: str, model: str, fields: Optional[List[str]] = None) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+    """Extract invoice fields with a single model, return the data and statistics of every call made
+    
+    Short documents are sent through the micro-batcher; if the batch does not
+    return a usable result for this document, it is retried on its own and
+    both the batch share and the retry are returned.
+    """
+    fields = fields or list(INVOICE_FIELDS)
+    calls = []
+    
+    if extraction_batcher.accepts(text):
+        invoice_data, batch_stats = extraction_batcher.submit(text, model, fields).result()
+        if batch_stats is not None:
+            calls.append(batch_stats)
+        if invoice_data is not None:
+            return invoice_data, calls
+        logger.info(f"Batched extraction with {model} failed for a document, retrying individually")
+    
+    invoice_data, stats = extract_single(text, model, fields)
+    calls.append(stats)
+    return invoice_data, calls
+
+def extract_single(text: str, model: str, fields: List[str]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """Extract invoice fields of one document in its own Ollama request"""
+    llm_response, stats = call_ollama(build_extraction_prompt(text, fields), model)
+    stats["fields"] = fields
+    
+    if llm_response is None:
+        return create_empty_invoice_data(), stats
+    
+    try:
+        invoice_data = parse_llm_json(llm_response)
+    except json.JSONDecodeError:
+        logger.error(f"Failed to parse JSON from LLM response: {llm_response}")
+        return create_empty_invoice_data(), stats
+    
+    if not isinstance(invoice_data, dict):
+        logger.error(f"Unexpected JSON from LLM response: {llm_response}")
+        return create_empty_invoice_data(), stats
+    
+    return invoice_data, stats
+
+class ExtractionJob:
+    """A document waiting in the micro-batcher"""
+    
+    def __init__(self, text: str):
+        self.text = text
+        self.tokens = estimate_tokens(text)
+        # Resolves to (invoice_data, stats); invoice_data is None when the document has to be
+        # retried individually, stats is None when no batch call was made
+        self.future: Future = Future()
+
+class ExtractionBatcher:
+    """Collects extraction jobs for the same model and fields and sends them as one Ollama request
+    
+    A batch is sent when it reaches `max_docs` documents, when the next document
+    would exceed `token_budget`, or `max_wait_ms` after its first document arrived.
+    """
+    
+    def __init__(self, max_docs: int, max_wait_ms: int, token_budget: int):
+        self.max_docs = max_docs
+        self.max_wait = max_wait_ms / 1000
+        self.token_budget = token_budget
+        self._lock = threading.Lock()
+        self._pending: Dict[Tuple[str, Tuple[str, ...]], List[ExtractionJob]] = {}
+    
+    def accepts(self, text: str) -> bool:
+        """Check whether a document is short enough to share a request with others"""
+        return self.max_docs > 1 and estimate_tokens(text) <= self.token_budget // 2
+    
+    def submit(self, text: str, model: str, fields: List[str]) -> Future:
+        """Queue a document for batched extraction"""
+        job = ExtractionJob(text)
+        key = (model, tuple(fields))
+        ready = []
         
-        if response.status_code == 200:
-            response_data = response.json()
-            llm_response = response_data.get("response", "")
+        with self._lock:
+            batch = self._pending.get(key)
+            if batch and sum(pending.tokens for pending in batch) + job.tokens > self.token_budget:
+                # Token budget exceeded, send the waiting batch and start a new one
+                ready.append(self._pending.pop(key))
+                batch = None
             
-            # Extract JSON from the response
-            try:
-                # Find JSON in the response (it might be surrounded by markdown code blocks or other text)
-                json_match = re.search(r'```json\s*([\s\S]*?)\s*```|^\s*(\{[\s\S]*\})\s*$', llm_response)
-                
-                if json_match:
-                    json_str = json_match.group(1) or json_match.group(2)
-                    invoice_data = json.loads(json_str)
-                else:
-                    # Try to parse the entire response as JSON
-                    invoice_data = json.loads(llm_response)
-                
-                return invoice_data
+            if batch is None:
+                batch = self._pending[key] = []
+                timer = threading.Timer(self.max_wait, self._flush, args=(key, batch))
+                timer.daemon = True
+                timer.start()
             
-            except json.JSONDecodeError:
-                logger.error(f"Failed to parse JSON from LLM response: {llm_response}")
-                return create_empty_invoice_data()
-        else:
-            logger.error(f"Ollama API error: {response.status_code} - {response.text}")
-            return create_empty_invoice_data()
+            batch.append(job)
+            if len(batch) >= self.max_docs:
+                ready.append(self._pending.pop(key))
+        
+        for ready_batch in ready:
+            self._run(key, ready_batch)
+        
+        return job.future
+    
+    def _flush(self, key: Tuple[str, Tuple[str, ...]], batch: List[ExtractionJob]) -> None:
+        """Send a batch whose wait time has elapsed (unless it was already sent)"""
+        with self._lock:
+            if self._pending.get(key) is not batch:
+                return
+            del self._pending[key]
+        
+        self._run(key, batch)
+    
+    def _run(self, key: Tuple[str, Tuple[str, ...]], batch: List[ExtractionJob]) -> None:
+        """Extract a batch and fan the results out to the waiting jobs"""
+        model, fields = key
+        results: Dict[str, Any] = {}
+        
+        try:
+            if len(batch) == 1:
+                # Nothing to share the request with, the caller sends it on its own
+                batch[0].future.set_result((None, None))
+                return
+            
+            documents = {str(index): job.text for index, job in enumerate(batch, start=1)}
+            llm_response, stats = call_ollama(build_batch_extraction_prompt(documents, list(fields)), model)
+            
+            if llm_response is not None:
+                try:
+                    results = index_batch_results(parse_llm_json(llm_response))
+                except json.JSONDecodeError:
+                    logger.error(f"Failed to parse JSON from batched LLM response: {llm_response}")
+            
+            logger.info(f"Batched extraction of {len(batch)} documents with {model}: {len(results)} results")
+            
+            # Split the shared cost (GPU time, tokens) between the documents of the batch;
+            # latency stays whole, every document waited for the entire call
+            job_stats = dict(stats)
+            job_stats["fields"] = list(fields)
+            job_stats["batch_size"] = len(batch)
+            job_stats["gpu_ms"] = round(stats["gpu_ms"] / len(batch), 1)
+            job_stats["prompt_tokens"] = stats["prompt_tokens"] // len(batch)
+            job_stats["completion_tokens"] = stats["completion_tokens"] // len(batch)
+            
+            for document_id, job in zip(documents, batch):
+                invoice_data = results.get(document_id)
+                if not isinstance(invoice_data, dict):
+                    invoice_data = None
+                # The batch share is recorded even when the document has to be retried,
+                # but only counts as a successful call when it produced data for the document
+                document_stats = dict(job_stats)
+                document_stats["ok"] = stats["ok"] and invoice_data is not None
+                job.future.set_result((invoice_data, document_stats))
+        
+        except Exception as e:
+            logger.error(f"Error in batched extraction with {model}: {e}")
+            for job in batch:
+                if not job.future.done():
+                    job.future.set_result((None, None))
+
+def index_batch_results(parsed: Any) -> Dict[str, Any]:
+    """Map a batched LLM response (array of objects or object keyed by ID) to document IDs"""
+    if isinstance(parsed, dict):
+        return {str(document_id): data for document_id, data in parsed.items()}
+    
+    results = {}
+    if isinstance(parsed, list):
+        for item in parsed:
+            if isinstance(item, dict) and item.get("document_id") is not None:
+                invoice_data = dict(item)
+                document_id = str(invoice_data.pop("document_id"))
+                results[document_id] = invoice_data
+    return results
+
+extraction_batcher = ExtractionBatcher(LLM_BATCH_MAX_DOCS, LLM_BATCH_WAIT_MS, LLM_BATCH_TOKEN_BUDGET)
+
+def process_text_with_llm(text: str, model: str) -> Dict[str, Any]:
+    """Process extracted text with LLM to extract invoice data"""
+    try:
+        invoice_data, _ = extract_with_model(text, model)
+        return invoice_data
     
     except Exception as e:
         logger.error(f"Error processing text with LLM: {e}")
@@ -237,21 +532,79 @@ def process_text_with_llm(text: str, model: str) -> Dict[str, Any]:
 
 def create_empty_invoice_data() -> Dict[str, Any]:
     """Create empty invoice data structure"""
-    return {
-        "invoice_number": None,
-        "invoice_date": None,
-        "due_date": None,
-        "total_amount": None,
-        "vat_amount": None,
-        "currency": None,
-        "supplier_name": None,
-        "supplier_tax_id": None,
-        "supplier_vat_id": None,
-        "customer_name": None,
-        "customer_tax_id": None,
-        "customer_vat_id": None,
-        "confidence_score": 0.0
+    return {field: None for field in INVOICE_FIELDS}
+
+def is_valid_ico(value: Optional[str]) -> bool:
+    """Check a Czech company ID (IČO) using its mod 11 checksum"""
+    digits = re.sub(r'\s', '', str(value or ""))
+    if not digits.isdigit() or len(digits) > 8:
+        return False
+    
+    digits = digits.zfill(8)
+    weighted_sum = sum(int(digit) * weight for digit, weight in zip(digits[:7], range(8, 1, -1)))
+    return (11 - weighted_sum % 11) % 10 == int(digits[7])
+
+def is_valid_tax_id(value: Optional[str], vat_id: Optional[str] = None) -> bool:
+    """Check a tax ID; only Czech IDs (digits only, or the party has a CZ VAT ID) are checked as IČO
+    
+    Foreign tax IDs (e.g. DE123456789) cannot be verified and are accepted.
+    """
+    tax_id = re.sub(r'\s', '', str(value or ""))
+    looks_czech = (tax_id.isdigit() and len(tax_id) <= 8) or re.sub(r'\s', '', str(vat_id or "")).upper().startswith("CZ")
+    return is_valid_ico(tax_id) if looks_czech else bool(tax_id)
+
+def is_valid_dic(value: Optional[str], ico: Optional[str] = None) -> bool:
+    """Check a VAT ID (DIČ); Czech legal entity DIČ must contain a valid IČO"""
+    vat_id = re.sub(r'\s', '', str(value or "")).upper()
+    
+    if vat_id.startswith("CZ"):
+        digits = vat_id[2:]
+        if not digits.isdigit() or not 8 <= len(digits) <= 10:
+            return False
+        if len(digits) == 8:
+            # DIČ of a legal entity is CZ + IČO
+            if not is_valid_ico(digits):
+                return False
+            if ico and is_valid_ico(ico) and digits != re.sub(r'\s', '', str(ico)).zfill(8):
+                return False
+        return True
+    
+    # Other EU VAT IDs: country code followed by 2-13 alphanumeric characters
+    return re.match(r'^[A-Z]{2}[0-9A-Z]{2,13}$', vat_id) is not None
+
+def validate_invoice_data(invoice_data: Dict[str, Any]) -> Tuple[float, List[str]]:
+    """Validate extracted invoice fields, return confidence (share of passed checks) and invalid fields
+    
+    Required fields are always checked, optional fields only when present.
+    """
+    def present(field: str) -> bool:
+        return invoice_data.get(field) not in (None, "")
+    
+    invoice_date = parse_date(invoice_data.get("invoice_date"))
+    due_date = parse_date(invoice_data.get("due_date"))
+    total_amount = parse_float(invoice_data.get("total_amount"))
+    vat_amount = parse_float(invoice_data.get("vat_amount"))
+    
+    checks = {
+        "invoice_number": present("invoice_number"),
+        "invoice_date": invoice_date is not None,
+        "due_date": due_date is not None and (invoice_date is None or due_date >= invoice_date),
+        "total_amount": total_amount is not None and total_amount > 0,
+        "vat_amount": vat_amount is not None and vat_amount >= 0 and (total_amount is None or vat_amount < total_amount),
+        "currency": re.match(r'^[A-Z]{3}$', str(invoice_data.get("currency") or "").strip().upper()) is not None,
+        "supplier_name": present("supplier_name"),
+        "supplier_tax_id": is_valid_tax_id(invoice_data.get("supplier_tax_id"), invoice_data.get("supplier_vat_id")),
+        "supplier_vat_id": is_valid_dic(invoice_data.get("supplier_vat_id"), invoice_data.get("supplier_tax_id")),
+        "customer_name": present("customer_name"),
+        "customer_tax_id": is_valid_tax_id(invoice_data.get("customer_tax_id"), invoice_data.get("customer_vat_id")),
+        "customer_vat_id": is_valid_dic(invoice_data.get("customer_vat_id"), invoice_data.get("customer_tax_id")),
     }
+    
+    # Skip optional fields the invoice does not contain
+    checks = {field: ok for field, ok in checks.items() if field in REQUIRED_FIELDS or present(field)}
+    invalid_fields = [field for field, ok in checks.items() if not ok]
+    confidence = round(1 - len(invalid_fields) / len(checks), 2)
+    return confidence, invalid_fields
 
 def parse_date(date_str: Optional[str]) -> Optional[datetime]:
     """Parse date string to datetime object"""